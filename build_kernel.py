@@ -0,0 +1,45 @@
+"""
+Backtest Kernel Builder
+Precompiles the worker's Numba kernels at VM image build time.
+numba.pycc (the old AOT compiler) was deprecated in numba 0.57 and is
+removed from current releases, so this uses the supported cache=True
+mechanism instead: compile the kernels here, ship the on-disk cache in
+the image, and the first job pays no JIT warm-up.
+Run once at image build time: python build_kernel.py
+Exits non-zero if no cache was written, failing the image build loudly.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import worker
+
+
+def main():
+    # Dummy inputs just long enough to cover the largest slow window
+    n = max(worker.WINDOWS) + 100
+    close = np.linspace(100.0, 200.0, n).astype(np.float32)
+    csum = np.concatenate(([0.0], np.cumsum(close, dtype=np.float64)))
+    sma_mat = np.full((len(worker.WINDOWS), n), np.nan, dtype=np.float32)
+    for j, k in enumerate(worker.WINDOWS):
+        sma_mat[j, k - 1:] = worker.sma(csum, k)
+
+    # One call compiles _sweep and _bt with the production signatures
+    out = np.empty(len(worker.PAIRS), dtype=worker.RESULT_DTYPE)
+    worker._sweep(close, sma_mat, worker.FAST_IDX, worker.SLOW_IDX,
+                  worker.STARTS, worker.TRADING_FEE,
+                  out['total_return'], out['num_trades'], out['win_rate'])
+
+    cache_dir = Path(worker.__file__).parent / "__pycache__"
+    cache_files = list(cache_dir.glob("*.nbi")) + list(cache_dir.glob("*.nbc"))
+    if not cache_files:
+        sys.exit("ERROR: Numba cache was not written; "
+                 "kernels would JIT-compile on the first job")
+
+    print(f"Compiled worker kernels into {cache_dir} ({len(cache_files)} cache files)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,10 @@ Uses Azure AD authentication (no connection string needed).
 """
 
 import os
-import json
-from itertools import product
+import base64
+import msgpack
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from azure.identity import DefaultAzureCredential
 from azure.storage.queue import QueueServiceClient
 from azure.storage.blob import BlobServiceClient
@@ -17,10 +19,6 @@ STORAGE_ACCOUNT_NAME = os.environ.get("AZURE_STORAGE_ACCOUNT_NAME")
 QUEUE_NAME = "backtest-jobs"
 DATA_CONTAINER = "raw-data"
 
-# Parameter ranges
-FAST_RANGE = list(range(5, 101, 5))      # [5, 10, 15, ... 100] - 20 values
-SLOW_RANGE = list(range(20, 301, 10))    # [20, 30, 40, ... 300] - 29 values
-
 
 def get_credential():
     """Get Azure AD credential."""
@@ -44,36 +42,43 @@ def get_available_coins():
 
 
 def generate_jobs(coins: list) -> list:
-    """Generate all parameter combinations."""
-    jobs = []
-    
-    for coin in coins:
-        for fast, slow in product(FAST_RANGE, SLOW_RANGE):
-            if fast < slow:  # fast MA must be shorter than slow MA
-                jobs.append({
-                    "coin": coin,
-                    "fast_ma": fast,
-                    "slow_ma": slow
-                })
-    
-    return jobs
+    """
+    Generate one job per coin.
+    The worker sweeps the whole (fast, slow) parameter grid in-process,
+    so the coin's parquet is downloaded and parsed once instead of once
+    per parameter combination.
+    """
+    return [{"coin": coin} for coin in coins]
 
 
 def push_jobs_to_queue(jobs: list):
     """Push all jobs to Azure Queue."""
     credential = get_credential()
     account_url = f"https://{STORAGE_ACCOUNT_NAME}.queue.core.windows.net"
-    queue_service = QueueServiceClient(account_url=account_url, credential=credential)
+    # Pool sized to match the send concurrency
+    queue_service = QueueServiceClient(
+        account_url=account_url, credential=credential,
+        connection_pool_maxsize=32
+    )
     queue_client = queue_service.get_queue_client(QUEUE_NAME)
-    
+
     print(f"Pushing {len(jobs)} jobs to queue...")
-    
-    for i, job in enumerate(jobs):
-        queue_client.send_message(json.dumps(job))
-        
-        if (i + 1) % 100 == 0:
-            print(f"  Pushed {i + 1}/{len(jobs)}")
-    
+
+    # Each send is one HTTP round-trip, so overlap them across threads
+    pushed = 0
+    lock = threading.Lock()
+
+    def send(job):
+        nonlocal pushed
+        queue_client.send_message(base64.b64encode(msgpack.packb(job)).decode())
+        with lock:
+            pushed += 1
+            if pushed % 100 == 0:
+                print(f"  Pushed {pushed}/{len(jobs)}")
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(send, jobs))
+
     print(f"Done. {len(jobs)} jobs in queue.")
 
 
@@ -94,10 +99,9 @@ def main():
         print("Upload your data files first")
         exit(1)
     
-    # Generate jobs
+    # Generate jobs (one per coin; workers sweep the parameter grid)
     jobs = generate_jobs(coins)
     print(f"Generated {len(jobs)} jobs")
-    print(f"  {len(coins)} coins × {len(FAST_RANGE)} fast × {len(SLOW_RANGE)} slow params")
     
     # Push to queue
     push_jobs_to_queue(jobs)
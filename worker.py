@@ -5,13 +5,19 @@ Uses Azure AD authentication (Managed Identity on VMSS).
 """
 
 import os
-import json
+import socket
+import base64
+import asyncio
+import msgpack
 import time
-from azure.identity import DefaultAzureCredential
-from azure.storage.queue import QueueServiceClient
-from azure.storage.blob import BlobServiceClient
-import pandas as pd
+from azure.identity.aio import DefaultAzureCredential
+from azure.storage.queue.aio import QueueServiceClient
+from azure.storage.blob.aio import BlobServiceClient
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from numba import njit, prange
+from bisect import bisect_right
 from io import BytesIO
 
 # Config
@@ -20,175 +26,310 @@ QUEUE_NAME = "backtest-jobs"
 DATA_CONTAINER = "raw-data"
 RESULTS_CONTAINER = "backtest-results"
 
+# Unique per worker process, used to name the results blob
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
 # Trading fee
 TRADING_FEE = 0.001
 
+# Parameter ranges (swept per coin by the worker)
+FAST_RANGE = list(range(5, 101, 5))      # [5, 10, 15, ... 100] - 20 values
+SLOW_RANGE = list(range(20, 301, 10))    # [20, 30, 40, ... 300] - 29 values
+
+# Precomputed sweep layout: all valid (fast, slow) pairs, with each
+# window size assigned a row index in the per-coin SMA matrix
+WINDOWS = sorted(set(FAST_RANGE) | set(SLOW_RANGE))
+_WINDOW_IDX = {k: j for j, k in enumerate(WINDOWS)}
+# Enumerate only valid pairs (fast < slow) instead of filtering the full grid
+PAIRS = [(f, s) for f in FAST_RANGE for s in SLOW_RANGE[bisect_right(SLOW_RANGE, f):]]
+FAST_IDX = np.array([_WINDOW_IDX[f] for f, s in PAIRS], dtype=np.int64)
+SLOW_IDX = np.array([_WINDOW_IDX[s] for f, s in PAIRS], dtype=np.int64)
+STARTS = np.array([s - 1 for f, s in PAIRS], dtype=np.int64)
+PAIR_FAST = np.array([f for f, s in PAIRS], dtype=np.int32)
+PAIR_SLOW = np.array([s for f, s in PAIRS], dtype=np.int32)
+
+# One row per (fast, slow) pair; the kernel writes straight into the
+# field views, so no per-row Python objects are ever allocated
+RESULT_DTYPE = np.dtype([
+    ('fast_ma', 'i4'),
+    ('slow_ma', 'i4'),
+    ('total_return', 'f8'),
+    ('num_trades', 'i4'),
+    ('win_rate', 'f4')
+])
+
 
 def get_credential():
     """Get Azure AD credential (uses Managed Identity on VMSS)."""
     return DefaultAzureCredential()
 
 
-def get_queue_client():
-    """Connect to Azure Queue."""
-    credential = get_credential()
+def get_queue_client(credential):
+    """Connect to Azure Queue (async client)."""
     account_url = f"https://{STORAGE_ACCOUNT_NAME}.queue.core.windows.net"
     queue_service = QueueServiceClient(account_url=account_url, credential=credential)
     return queue_service.get_queue_client(QUEUE_NAME)
 
 
-def get_blob_service():
-    """Connect to Azure Blob Storage."""
-    credential = get_credential()
+def get_blob_service(credential):
+    """Connect to Azure Blob Storage (async client)."""
     account_url = f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
+    # The aiohttp transport keeps a shared connection pool (100 by
+    # default), so connections are reused across every blob op
     return BlobServiceClient(account_url=account_url, credential=credential)
 
 
-def load_price_data(blob_service, coin: str) -> pd.DataFrame:
-    """Load price data from blob storage."""
-    blob_client = blob_service.get_blob_client(DATA_CONTAINER, f"{coin}.parquet")
-    
-    stream = BytesIO()
-    stream.write(blob_client.download_blob().readall())
-    stream.seek(0)
-    
-    df = pd.read_parquet(stream)
-    return df[["timestamp", "close"]]
+async def load_price_data(data_container, coin: str) -> np.ndarray:
+    """Load close prices from blob storage as a float32 array."""
+    blob_client = data_container.get_blob_client(f"{coin}.parquet")
+
+    # Download chunks over parallel connections instead of one serial stream
+    downloader = await blob_client.download_blob(max_concurrency=16)
+    data = await downloader.readall()
 
+    # Parquet is columnar: read only the close column, skip pandas
+    table = pq.read_table(BytesIO(data), columns=['close'])
+    # float32 halves the memory traffic of the sweep
+    return table.column('close').to_numpy(zero_copy_only=False).astype(np.float32)
 
-def run_backtest(prices: pd.DataFrame, fast_ma: int, slow_ma: int) -> dict:
+
+@njit(cache=True, fastmath=True)
+def _bt(close, fast, slow, fee):
     """
-    Run single MA crossover backtest.
-    Returns dict with results.
+    Walk the bars once and track trades.
+    Compiled to native code by Numba; cache=True so the compile
+    cost is paid once per worker image, not per process start.
+    Returns: (total_return, num_trades, win_rate)
     """
-    df = prices.copy()
-    df['fast'] = df['close'].rolling(window=fast_ma).mean()
-    df['slow'] = df['close'].rolling(window=slow_ma).mean()
-    df = df.dropna()
-    
-    if len(df) == 0:
-        return {
-            "total_return": 0.0,
-            "num_trades": 0,
-            "win_rate": 0.0
-        }
-    
-    # Generate signals
-    df['signal'] = 0
-    df.loc[df['fast'] > df['slow'], 'signal'] = 1
-    df.loc[df['fast'] < df['slow'], 'signal'] = -1
-    
-    # Track trades
     position = 0
-    entry_price = 0
-    trades = []
-    
-    for i, row in df.iterrows():
-        if row['signal'] == 1 and position == 0:
+    entry_price = 0.0
+    # Sum log returns instead of multiplying (1 + pnl) factors: the
+    # accumulator can't overflow/underflow no matter how many trades
+    log_growth = 0.0
+    num_trades = 0
+    wins = 0
+
+    for i in range(len(close)):
+        if fast[i] > slow[i] and position == 0:
             position = 1
-            entry_price = row['close'] * (1 + TRADING_FEE)
-        elif row['signal'] == -1 and position == 1:
-            exit_price = row['close'] * (1 - TRADING_FEE)
-            pnl = (exit_price - entry_price) / entry_price
-            trades.append(pnl)
+            entry_price = close[i] * (1 + fee)
+        elif fast[i] < slow[i] and position == 1:
+            exit_price = close[i] * (1 - fee)
+            pnl = exit_price / entry_price - 1
+            log_growth += np.log1p(pnl)
+            num_trades += 1
+            if pnl > 0:
+                wins += 1
             position = 0
-    
-    if len(trades) == 0:
-        return {
-            "total_return": 0.0,
-            "num_trades": 0,
-            "win_rate": 0.0
-        }
-    
-    total_return = np.prod([1 + t for t in trades]) - 1
-    win_rate = sum(1 for t in trades if t > 0) / len(trades)
-    
-    return {
-        "total_return": total_return,
-        "num_trades": len(trades),
-        "win_rate": win_rate
-    }
-
-
-def save_result(blob_service, result: dict):
-    """Save result to blob storage."""
-    blob_client = blob_service.get_blob_client(
-        RESULTS_CONTAINER, 
-        f"{result['coin']}_{result['fast_ma']}_{result['slow_ma']}.json"
-    )
-    
-    blob_client.upload_blob(json.dumps(result), overwrite=True)
-
-
-def process_job(blob_service, job: dict) -> dict:
-    """Process a single backtest job."""
-    coin = job["coin"]
-    fast_ma = job["fast_ma"]
-    slow_ma = job["slow_ma"]
-    
-    print(f"Processing: {coin} fast={fast_ma} slow={slow_ma}")
-    
-    # Load data
-    prices = load_price_data(blob_service, coin)
-    
-    # Run backtest
-    result = run_backtest(prices, fast_ma, slow_ma)
-    
-    # Add job info to result
-    result["coin"] = coin
-    result["fast_ma"] = fast_ma
-    result["slow_ma"] = slow_ma
-    
-    return result
-
-
-def worker_loop():
+
+    if num_trades == 0:
+        return 0.0, 0, 0.0
+
+    return np.expm1(log_growth), num_trades, wins / num_trades
+
+
+def sma(csum: np.ndarray, k: int) -> np.ndarray:
+    """
+    Simple moving average from a prefix-sum array in O(N).
+    csum must be np.cumsum(close) with a leading 0.
+    Element i of the result is the mean of bars [i, i+k).
+    """
+    return (csum[k:] - csum[:-k]) / k
+
+
+@njit(cache=True, fastmath=True, parallel=True)
+def _sweep(close, sma_mat, fast_idx, slow_idx, starts,
+           fee, out_return, out_trades, out_winrate):
+    """
+    Run every (fast, slow) backtest of the grid in parallel.
+    sma_mat rows are full-length SMAs aligned to bar index; each pair
+    starts at its slow-MA warm-up point.
+    """
+    for p in prange(len(fast_idx)):
+        start = starts[p]
+        total_return, num_trades, win_rate = _bt(
+            close[start:],
+            sma_mat[fast_idx[p], start:],
+            sma_mat[slow_idx[p], start:],
+            fee
+        )
+        out_return[p] = total_return
+        out_trades[p] = num_trades
+        out_winrate[p] = win_rate
+
+
+async def save_results(results_container, results: list):
+    """
+    Save every result this worker produced as a single parquet blob.
+    results is a list of (coin, struct_array) tuples from run_sweep.
+    """
+    blob_client = results_container.get_blob_client(f"worker-{WORKER_ID}.parquet")
+
+    combined = np.concatenate([out for coin, out in results])
+    coins = np.concatenate([np.repeat(coin, len(out)) for coin, out in results])
+    table = pa.table({
+        'coin': coins,
+        'fast_ma': combined['fast_ma'],
+        'slow_ma': combined['slow_ma'],
+        'total_return': combined['total_return'],
+        'num_trades': combined['num_trades'],
+        'win_rate': combined['win_rate']
+    })
+
+    buf = BytesIO()
+    pq.write_table(table, buf, compression='zstd')
+    await blob_client.upload_blob(buf.getvalue(), overwrite=True)
+
+
+def run_sweep(coin: str, close: np.ndarray) -> np.ndarray:
+    """Sweep the whole parameter grid for one coin (pure compute)."""
+    # cumsum in float64 to avoid cancellation error in the window subtraction
+    csum = np.concatenate(([0.0], np.cumsum(close, dtype=np.float64)))
+
+    # Each window size is shared by ~20-29 parameter pairs, so compute
+    # every SMA once up front, stacked into one matrix for the kernel
+    sma_mat = np.full((len(WINDOWS), len(close)), np.nan, dtype=np.float32)
+    for j, k in enumerate(WINDOWS):
+        sma_mat[j, k - 1:] = sma(csum, k)
+
+    out = np.empty(len(PAIRS), dtype=RESULT_DTYPE)
+    out['fast_ma'] = PAIR_FAST
+    out['slow_ma'] = PAIR_SLOW
+    # The kernel's compile cost is paid at image build time by
+    # build_kernel.py, which warms the on-disk Numba cache
+    _sweep(close, sma_mat, FAST_IDX, SLOW_IDX, STARTS, TRADING_FEE,
+           out['total_return'], out['num_trades'], out['win_rate'])
+
+    return out
+
+
+def parse_job(message):
+    """Decode one queue message; returns None if it is malformed."""
+    try:
+        return msgpack.unpackb(base64.b64decode(message.content))
+    except Exception as e:
+        print(f"Error parsing message: {e}")
+        return None
+
+
+async def drain_deletes(queue_client, delete_queue):
+    """
+    Delete processed messages in the background so the worker never
+    waits on a delete round-trip. Stops on a None sentinel.
+    """
+    while True:
+        message = await delete_queue.get()
+        if message is None:
+            break
+        try:
+            await queue_client.delete_message(message)
+        except Exception as e:
+            print(f"Error deleting message: {e}")
+
+
+async def worker_loop():
     """Main worker loop. Pulls jobs until queue is empty."""
     print("Worker starting...")
     print(f"Storage account: {STORAGE_ACCOUNT_NAME}")
     print(f"Queue: {QUEUE_NAME}")
     print(f"Data container: {DATA_CONTAINER}")
     print(f"Results container: {RESULTS_CONTAINER}")
-    
-    queue_client = get_queue_client()
-    blob_service = get_blob_service()
-    
+
+    # Create clients once and reuse them for every job so the HTTP
+    # transport keeps its connections warm
+    credential = get_credential()
+    queue_client = get_queue_client(credential)
+    blob_service = get_blob_service(credential)
+    data_container = blob_service.get_container_client(DATA_CONTAINER)
+    results_container = blob_service.get_container_client(RESULTS_CONTAINER)
+
     jobs_processed = 0
-    
-    while True:
-        # Get next message
-        messages = queue_client.receive_messages(max_messages=1, visibility_timeout=300)
-        
-        message = None
-        for msg in messages:
-            message = msg
-            break
-        
-        if message is None:
-            print(f"Queue empty. Processed {jobs_processed} jobs. Exiting.")
-            break
-        
+    # Results from every job this worker runs; uploaded as one
+    # compressed parquet on shutdown instead of one blob per coin
+    all_results = []
+
+    async with credential, queue_client, blob_service:
+        delete_queue = asyncio.Queue()
+        deleter = asyncio.create_task(drain_deletes(queue_client, delete_queue))
+
         try:
-            # Parse job
-            job = json.loads(message.content)
-            
-            # Process it
-            result = process_job(blob_service, job)
-            
-            # Save result
-            save_result(blob_service, result)
-            
-            # Delete message from queue
-            queue_client.delete_message(message)
-            
-            jobs_processed += 1
-            print(f"Completed job {jobs_processed}: {result['coin']} return={result['total_return']:.2%}")
-            
-        except Exception as e:
-            print(f"Error processing job: {e}")
-            # Message will become visible again after timeout
-            continue
-    
+            while True:
+                # Get next batch of messages (one HTTP round-trip for up to
+                # 32 jobs instead of one per job)
+                messages = queue_client.receive_messages(
+                    messages_per_page=32, max_messages=32, visibility_timeout=600
+                )
+                batch = [message async for message in messages]
+
+                if not batch:
+                    print(f"Queue empty. Processed {jobs_processed} jobs. Exiting.")
+                    break
+
+                # Skip malformed messages; they become visible again after
+                # the timeout instead of killing the worker
+                jobs = []
+                for message in batch:
+                    job = parse_job(message)
+                    if job is not None:
+                        jobs.append((message, job))
+
+                # Pipeline the batch: prefetch the next coin's blob while the
+                # current sweep runs; deletes go to the background drainer
+                # once the batch's results are persisted
+                download = None
+                processed = []
+                for i, (message, job) in enumerate(jobs):
+                    try:
+                        coin = job["coin"]
+
+                        if download is None:
+                            download = asyncio.create_task(
+                                load_price_data(data_container, coin)
+                            )
+                        current = download
+                        download = None
+                        if i + 1 < len(jobs):
+                            download = asyncio.create_task(
+                                load_price_data(data_container, jobs[i + 1][1]["coin"])
+                            )
+
+                        close = await current
+
+                        print(f"Processing: {coin} ({len(FAST_RANGE)}x{len(SLOW_RANGE)} parameter grid)")
+                        # Run the sweep in a thread so the event loop keeps
+                        # the prefetch download moving
+                        results = await asyncio.to_thread(run_sweep, coin, close)
+                        all_results.append((coin, results))
+                        processed.append(message)
+
+                        jobs_processed += 1
+                        print(f"Completed job {jobs_processed}: {coin} ({len(results)} backtests)")
+
+                    except Exception as e:
+                        print(f"Error processing job: {e}")
+                        # Message will become visible again after timeout
+                        continue
+
+                # Re-upload the accumulated results (overwrite=True, so
+                # each flush just replaces the blob) before this batch's
+                # messages are deleted: a crash can never lose the
+                # results of an already-deleted job
+                if processed:
+                    await save_results(results_container, all_results)
+                    for message in processed:
+                        delete_queue.put_nowait(message)
+
+        finally:
+            # Runs even if the loop dies unexpectedly: persist whatever
+            # results have accumulated, then flush outstanding deletes
+            if all_results:
+                await save_results(results_container, all_results)
+                num_results = sum(len(out) for _, out in all_results)
+                print(f"Uploaded {num_results} results as worker-{WORKER_ID}.parquet")
+
+            delete_queue.put_nowait(None)
+            await deleter
+
     print("Worker finished.")
 
 
@@ -196,5 +337,5 @@ if __name__ == "__main__":
     if not STORAGE_ACCOUNT_NAME:
         print("ERROR: AZURE_STORAGE_ACCOUNT_NAME environment variable not set")
         exit(1)
-    
-    worker_loop()
\ No newline at end of file
+
+    asyncio.run(worker_loop())